@@ -6,14 +6,18 @@ Analyzes tempo, key, vocal activity, and generates optimal cue points
 """
 
 import os
+import re
 import sys
 import json
 import numpy as np
+import scipy.fft
 import librosa
 import soundfile as sf
-from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+import soxr
+from typing import Dict, List, Tuple
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -28,6 +32,96 @@ except ImportError:
     ESSENTIA_AVAILABLE = False
     logger.warning("Essentia not available, using librosa fallbacks")
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# librosa's FFTs go through scipy.fft. The shared STFT runs alone and gets every core;
+# the stages after it run four at a time (pool workers plus the main thread) and split them
+STAGE_WORKERS = 3
+FFT_WORKERS = os.cpu_count() or 1
+STAGE_FFT_WORKERS = max(1, FFT_WORKERS // (STAGE_WORKERS + 1))
+
+
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def _escape_non_ascii(match) -> str:
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return '\\u%04x\\u%04x' % (0xD800 + (code >> 10), 0xDC00 + (code & 0x3FF))
+    return '\\u%04x' % code
+
+
+def _to_json(data: Dict) -> str:
+    """
+    Serialize analysis results as a single compact line.
+    The Node side parses only the last stdout line, so no pretty-printing.
+    Non-ASCII is escaped like json.dumps does: on Windows stdout is a cp1252 pipe,
+    and Node decodes each stdout chunk on its own.
+    """
+    if ORJSON_AVAILABLE:
+        out = orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+        return out if out.isascii() else _NON_ASCII.sub(_escape_non_ascii, out)
+    return json.dumps(data)
+
+
+def _with_fft_workers(workers: int, fn, *args):
+    """
+    Call fn(*args) with scipy.fft's worker count set for this thread only.
+    """
+    with scipy.fft.set_workers(workers):
+        return fn(*args)
+
+
+def _load_mono(path: str, sr: int) -> np.ndarray:
+    """
+    Decode to mono float32 at sr with libsndfile and one soxr call, matching
+    librosa.load's output. Formats libsndfile can't read go through librosa.
+    """
+    try:
+        y, native_sr = sf.read(path, dtype='float32', always_2d=True)
+    except RuntimeError:  # soundfile.LibsndfileError
+        return librosa.load(path, sr=sr)[0]
+    y = y.mean(axis=1)
+    if native_sr != sr:
+        y = soxr.resample(y, native_sr, sr, quality='HQ')
+    return y
+
+
+@lru_cache(maxsize=8)
+def _waveform_bands(sr: int, n_fft: int) -> Tuple[slice, slice, slice]:
+    """
+    STFT bin ranges for the waveform's bass (<= 250 Hz), mid (<= 4 kHz) and treble bands.
+    fft_frequencies is ascending, so each band is a contiguous slice.
+    """
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+    bass_end = int(np.searchsorted(freqs, 250, side='right'))
+    mid_end = int(np.searchsorted(freqs, 4000, side='right'))
+    return slice(0, bass_end), slice(bass_end, mid_end), slice(mid_end, None)
+
+
+def _active_segments(active: np.ndarray, times: np.ndarray, end_time: float, min_length: float) -> List[Dict]:
+    """
+    Turn a per-frame activity mask into {'start', 'end'} segments in one vectorized pass.
+    A segment ends at the first inactive frame and must last longer than min_length;
+    one still open at the last frame runs to end_time and is always kept.
+    """
+    edges = np.diff(active.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    open_ended = ends == len(active)
+    start_times = times[starts]
+    end_times = np.where(open_ended, end_time, times[np.minimum(ends, len(active) - 1)])
+    keep = open_ended | (end_times - start_times > min_length)
+
+    return [{'start': float(start), 'end': float(end)}
+            for start, end in zip(start_times[keep], end_times[keep])]
+
 class AutoDJAnalyzer:
     """
     Professional Auto-DJ track analyzer for seamless mixing
@@ -71,11 +165,14 @@ class AutoDJAnalyzer:
             logger.info(f"Analyzing track: {audio_file}")
             
             # Load audio
-            y, sr = librosa.load(audio_file, sr=self.sample_rate)
+            sr = self.sample_rate
+            y = _load_mono(audio_file, sr)
             duration = len(y) / sr
             
             logger.info(f"Loaded audio: {duration:.1f}s at {sr}Hz")
             
+            S, log_mel = _with_fft_workers(FFT_WORKERS, self._shared_spectra, y, sr)
+            
             # Core analysis
             analysis = {
                 'file': audio_file,
@@ -83,35 +180,50 @@ class AutoDJAnalyzer:
                 'sample_rate': sr
             }
             
-            # 1. Beat & Tempo Analysis
-            logger.info("Analyzing tempo and beats...")
-            beat_analysis = self._analyze_beats(y, sr)
-            analysis.update(beat_analysis)
-            
-            # 2. Key Detection
-            logger.info("Detecting musical key...")
-            key_analysis = self._analyze_key(y, sr)
-            analysis.update(key_analysis)
-            
-            # 3. Vocal Activity (using stems if available)
-            logger.info("Analyzing vocal activity...")
-            vocal_analysis = self._analyze_vocals(y, sr, stems_dir, os.path.basename(audio_file))
-            analysis.update(vocal_analysis)
-            
-            # 4. Structure Analysis (intro/outro detection)
-            logger.info("Analyzing track structure...")
-            structure_analysis = self._analyze_structure(y, sr, analysis['beatgrid'])
-            analysis.update(structure_analysis)
-            
-            # 5. Generate Cue Points
-            logger.info("Generating optimal cue points...")
-            cue_analysis = self._generate_cue_points(analysis)
-            analysis.update(cue_analysis)
-            
-            # 6. Waveform Data for Visualization
-            logger.info("Generating waveform visualization data...")
-            waveform_data = self._generate_waveform_data(y, sr)
-            analysis['waveform'] = waveform_data
+            # Key, vocal and waveform analysis only read y and the shared spectra, and
+            # spend most of their time in FFT/NumPy code that releases the GIL, so they
+            # run on worker threads while beats and structure are analyzed here
+            with ThreadPoolExecutor(max_workers=STAGE_WORKERS) as executor, \
+                    scipy.fft.set_workers(STAGE_FFT_WORKERS):
+                logger.info("Detecting musical key...")
+                key_future = executor.submit(
+                    _with_fft_workers, STAGE_FFT_WORKERS, self._analyze_key, y, sr
+                )
+                
+                logger.info("Analyzing vocal activity...")
+                vocal_future = executor.submit(
+                    _with_fft_workers, STAGE_FFT_WORKERS,
+                    self._analyze_vocals, y, sr, stems_dir, os.path.basename(audio_file), S, log_mel
+                )
+                
+                logger.info("Generating waveform visualization data...")
+                waveform_future = executor.submit(
+                    _with_fft_workers, STAGE_FFT_WORKERS, self._generate_waveform_data, y, sr
+                )
+                
+                # Beat & Tempo Analysis
+                logger.info("Analyzing tempo and beats...")
+                beat_analysis = self._analyze_beats(y, sr, log_mel)
+                analysis.update(beat_analysis)
+                
+                # Structure Analysis (intro/outro detection)
+                logger.info("Analyzing track structure...")
+                structure_analysis = self._analyze_structure(y, sr, analysis['beatgrid'])
+                
+                # Key Detection
+                analysis.update(key_future.result())
+                
+                # Vocal Activity (using stems if available)
+                analysis.update(vocal_future.result())
+                analysis.update(structure_analysis)
+                
+                # Generate Cue Points
+                logger.info("Generating optimal cue points...")
+                cue_analysis = self._generate_cue_points(analysis)
+                analysis.update(cue_analysis)
+                
+                # Waveform Data for Visualization
+                analysis['waveform'] = waveform_future.result()
             
             logger.info("Track analysis complete!")
             return analysis
@@ -121,13 +233,29 @@ class AutoDJAnalyzer:
             logger.info("Returning fallback analysis...")
             return self._create_fallback_analysis(audio_file, str(e))
     
-    def _analyze_beats(self, y: np.ndarray, sr: int) -> Dict:
+    def _shared_spectra(self, y: np.ndarray, sr: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        One STFT shared by onset/beat tracking and the main-audio vocal features;
+        each librosa feature would otherwise recompute it from y.
+        Returns (magnitude spectrogram, log-power mel spectrogram).
+        """
+        S = np.abs(librosa.stft(y, n_fft=self.frame_length, hop_length=self.hop_length))
+        log_mel = librosa.power_to_db(librosa.feature.melspectrogram(S=S ** 2, sr=sr))
+        return S, log_mel
+    
+    def _analyze_beats(self, y: np.ndarray, sr: int, log_mel: np.ndarray) -> Dict:
         """
         Advanced beat and tempo analysis using librosa
         """
         try:
-            # Tempo and beat tracking
-            tempo, beats = librosa.beat.beat_track(y=y, sr=sr, hop_length=self.hop_length)
+            # Tempo and beat tracking from the shared log-mel spectrogram; median
+            # aggregation matches the envelope beat_track(y=...) would build itself
+            onset_envelope = librosa.onset.onset_strength(
+                S=log_mel, sr=sr, hop_length=self.hop_length, aggregate=np.median
+            )
+            tempo, beats = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr, hop_length=self.hop_length)
+            # librosa >= 0.10 returns tempo as a 1-element array
+            tempo = float(np.atleast_1d(tempo)[0])
             
             # Convert beat frames to timestamps
             beat_times = librosa.frames_to_time(beats, sr=sr, hop_length=self.hop_length)
@@ -191,12 +319,9 @@ class AutoDJAnalyzer:
         Key detection using Essentia (more accurate)
         """
         try:
-            # Convert to Essentia format
-            audio_essentia = es.MonoLoader(filename='', sampleRate=sr)(y.astype(np.float32))
-            
-            # Key detection
-            key_extractor = es.KeyExtractor()
-            key, scale, strength = key_extractor(audio_essentia)
+            # Key detection; Essentia takes the already-loaded mono signal as float32
+            key_extractor = es.KeyExtractor(sampleRate=sr)
+            key, scale, strength = key_extractor(y.astype(np.float32, copy=False))
             
             # Format key name
             key_name = f"{key} {scale}"
@@ -264,7 +389,8 @@ class AutoDJAnalyzer:
                 'key_confidence': 0.5
             }
     
-    def _analyze_vocals(self, y: np.ndarray, sr: int, stems_dir: str, filename: str) -> Dict:
+    def _analyze_vocals(self, y: np.ndarray, sr: int, stems_dir: str, filename: str,
+                        S: np.ndarray, log_mel: np.ndarray) -> Dict:
         """
         Analyze vocal activity using stem separation if available
         """
@@ -275,6 +401,7 @@ class AutoDJAnalyzer:
                 # Try to find vocal stem
                 base_name = os.path.splitext(filename)[0]
                 vocal_patterns = [
+                    os.path.join(stems_dir, f"{base_name}_vocals.flac"),
                     os.path.join(stems_dir, f"{base_name}_vocals.wav"),
                     os.path.join(stems_dir, f"{base_name}", "vocals.wav"),
                     os.path.join(stems_dir, "vocals.wav")
@@ -288,14 +415,14 @@ class AutoDJAnalyzer:
                 
                 if vocal_file:
                     logger.info(f"Using vocal stem: {vocal_file}")
-                    vocal_y, _ = librosa.load(vocal_file, sr=sr)
+                    vocal_y = _load_mono(vocal_file, sr)
                     vocal_segments = self._detect_vocal_segments(vocal_y, sr)
                 else:
                     logger.info("No vocal stem found, using main audio for vocal detection")
-                    vocal_segments = self._detect_vocal_segments_from_main(y, sr)
+                    vocal_segments = self._detect_vocal_segments_from_main(y, sr, S, log_mel)
             else:
                 logger.info("No stems directory, using main audio for vocal detection")
-                vocal_segments = self._detect_vocal_segments_from_main(y, sr)
+                vocal_segments = self._detect_vocal_segments_from_main(y, sr, S, log_mel)
             
             return {
                 'vocals': vocal_segments,
@@ -321,36 +448,10 @@ class AutoDJAnalyzer:
             # Threshold for vocal activity (adjust based on testing)
             threshold = np.percentile(rms, 75)  # Use 75th percentile as threshold
             
-            # Find segments above threshold
+            # Find segments above threshold; segments of 2 seconds or less are dropped
             vocal_active = rms > threshold
-            
-            # Convert to time segments
-            segments = []
-            in_segment = False
-            start_time = 0
-            
-            for i, active in enumerate(vocal_active):
-                time = i * window_size
-                
-                if active and not in_segment:
-                    # Start of vocal segment
-                    start_time = time
-                    in_segment = True
-                elif not active and in_segment:
-                    # End of vocal segment
-                    if time - start_time > 2.0:  # Minimum 2 second segments
-                        segments.append({
-                            'start': start_time,
-                            'end': time
-                        })
-                    in_segment = False
-            
-            # Close final segment if needed
-            if in_segment:
-                segments.append({
-                    'start': start_time,
-                    'end': len(vocal_y) / sr
-                })
+            times = np.arange(len(vocal_active)) * window_size
+            segments = _active_segments(vocal_active, times, len(vocal_y) / sr, min_length=2.0)
             
             logger.info(f"Detected {len(segments)} vocal segments")
             return segments
@@ -359,14 +460,14 @@ class AutoDJAnalyzer:
             logger.warning(f"Vocal segment detection failed: {e}")
             return []
     
-    def _detect_vocal_segments_from_main(self, y: np.ndarray, sr: int) -> List[Dict]:
+    def _detect_vocal_segments_from_main(self, y: np.ndarray, sr: int, S: np.ndarray, log_mel: np.ndarray) -> List[Dict]:
         """
         Estimate vocal segments from main audio using spectral features
         """
         try:
             # Use spectral centroid and MFCC to estimate vocal presence
-            spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-            mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+            spectral_centroids = librosa.feature.spectral_centroid(S=S, sr=sr)[0]
+            mfccs = librosa.feature.mfcc(S=log_mel, n_mfcc=13)
             
             # Vocal frequency range typically has higher spectral centroid
             # and specific MFCC patterns
@@ -381,27 +482,8 @@ class AutoDJAnalyzer:
             hop_length = 512
             times = librosa.frames_to_time(np.arange(len(vocal_smooth)), sr=sr, hop_length=hop_length)
             
-            segments = []
-            in_segment = False
-            start_time = 0
-            
-            for i, (time, value) in enumerate(zip(times, vocal_smooth)):
-                if value > threshold and not in_segment:
-                    start_time = time
-                    in_segment = True
-                elif value <= threshold and in_segment:
-                    if time - start_time > 3.0:  # Minimum 3 seconds for main audio
-                        segments.append({
-                            'start': start_time,
-                            'end': time
-                        })
-                    in_segment = False
-            
-            if in_segment:
-                segments.append({
-                    'start': start_time,
-                    'end': len(y) / sr
-                })
+            # Minimum 3 seconds for main audio
+            segments = _active_segments(vocal_smooth > threshold, times, len(y) / sr, min_length=3.0)
             
             logger.info(f"Estimated {len(segments)} vocal segments from main audio")
             return segments
@@ -426,37 +508,25 @@ class AutoDJAnalyzer:
             from scipy import ndimage
             rms_smooth = ndimage.gaussian_filter1d(rms, sigma=3)
             
-            # Detect intro (low energy start)
+            # Detect intro (low energy start): first loud frame past 5s
             intro_threshold = np.percentile(rms_smooth, 40)
-            intro_end = 0
-            
-            for i, (time, energy) in enumerate(zip(times, rms_smooth)):
-                if energy > intro_threshold and time > 5.0:  # Must be at least 5s
-                    intro_end = time
-                    break
+            loud = rms_smooth > intro_threshold
+            intro_candidates = np.flatnonzero(loud & (times > 5.0))  # Must be at least 5s
+            intro_end = float(times[intro_candidates[0]]) if len(intro_candidates) else 0
             
             # Limit intro to reasonable length
             intro_end = min(intro_end, 32.0)  # Max 32 second intro
             
-            # Detect outro (low energy end, going backwards)
-            outro_start = duration
-            for i in range(len(rms_smooth) - 1, -1, -1):
-                time = times[i]
-                energy = rms_smooth[i]
-                if energy > intro_threshold and (duration - time) > 5.0:
-                    outro_start = time
-                    break
+            # Detect outro (low energy end): last loud frame more than 5s before the end
+            outro_candidates = np.flatnonzero(loud & (duration - times > 5.0))
+            outro_start = float(times[outro_candidates[-1]]) if len(outro_candidates) else duration
             
             # Limit outro
             outro_start = max(outro_start, duration - 32.0)  # Max 32 second outro
             
             # Find energy peaks (potential drops/builds)
-            energy_peaks = []
             peak_threshold = np.percentile(rms_smooth, 85)
-            
-            for i, (time, energy) in enumerate(zip(times, rms_smooth)):
-                if energy > peak_threshold:
-                    energy_peaks.append(time)
+            energy_peaks = times[rms_smooth > peak_threshold].tolist()
             
             logger.info(f"Structure: intro=0-{intro_end:.1f}s, outro={outro_start:.1f}s-{duration:.1f}s")
             
@@ -557,15 +627,12 @@ class AutoDJAnalyzer:
             magnitude = np.abs(stft)
             
             # Define frequency bands (bass, mid, treble)
-            freqs = librosa.fft_frequencies(sr=sr, n_fft=2048)
-            bass_idx = np.where(freqs <= 250)[0]
-            mid_idx = np.where((freqs > 250) & (freqs <= 4000))[0]
-            treble_idx = np.where(freqs > 4000)[0]
+            bass_bins, mid_bins, treble_bins = _waveform_bands(sr, 2048)
             
-            # Calculate energy in each band
-            bass_energy = np.mean(magnitude[bass_idx], axis=0)
-            mid_energy = np.mean(magnitude[mid_idx], axis=0)
-            treble_energy = np.mean(magnitude[treble_idx], axis=0)
+            # Calculate energy in each band; slices are views, so no band is copied out
+            bass_energy = np.mean(magnitude[bass_bins], axis=0)
+            mid_energy = np.mean(magnitude[mid_bins], axis=0)
+            treble_energy = np.mean(magnitude[treble_bins], axis=0)
             
             # Normalize
             max_energy = max(np.max(bass_energy), np.max(mid_energy), np.max(treble_energy))
@@ -638,7 +705,7 @@ def main():
                 'intro': {'start': 0.0, 'end': 8.0},
                 'outro': {'start': 164.0, 'end': 180.0}
             }
-            print(json.dumps(fallback_analysis, indent=2))
+            print(_to_json(fallback_analysis))
             return
         
         audio_file = sys.argv[1]
@@ -660,14 +727,14 @@ def main():
                 'intro': {'start': 0.0, 'end': 8.0},
                 'outro': {'start': 164.0, 'end': 180.0}
             }
-            print(json.dumps(fallback_analysis, indent=2))
+            print(_to_json(fallback_analysis))
             return
         
         analyzer = AutoDJAnalyzer()
         analysis = analyzer.analyze_track(audio_file, stems_dir)
         
         # Output analysis as JSON
-        print(json.dumps(analysis, indent=2))
+        print(_to_json(analysis))
         
     except Exception as e:
         logger.error(f"Fatal error in main: {str(e)}")
@@ -686,7 +753,7 @@ def main():
             'intro': {'start': 0.0, 'end': 8.0},
             'outro': {'start': 164.0, 'end': 180.0}
         }
-        print(json.dumps(fallback_analysis, indent=2))
+        print(_to_json(fallback_analysis))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
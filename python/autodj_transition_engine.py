@@ -6,9 +6,7 @@ Handles beatmatching, harmonic compatibility, and transition timing
 """
 
 import json
-import math
-import numpy as np
-from typing import Dict, List, Tuple, Optional
+from typing import Dict
 import logging
 
 logger = logging.getLogger(__name__)
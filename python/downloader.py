@@ -466,6 +466,9 @@ class MusicDownloader:
 
 def main():
     """Main function to run when script is called directly."""
+    # PROGRESS lines are read live over a pipe, where stdout is block-buffered by default
+    sys.stdout.reconfigure(line_buffering=True)
+    
     if len(sys.argv) < 3:
         print("Usage: python downloader.py <url> <output_dir> [quality] [format]")
         print("Example: python downloader.py 'https://youtube.com/watch?v=...' ./downloads 320 wav")
@@ -4,40 +4,185 @@ Simplified but robust Demucs-based stem processor.
 Uses the proven Demucs model with excellent error handling and progress feedback.
 """
 
-print("IMMEDIATE TEST: Demucs processor starting...", flush=True)
-print("PROGRESS: Script file loading started...", flush=True)
 import sys
-sys.stdout.flush()
+import os
 
-print("PROGRESS: Basic imports loading...", flush=True)
-sys.stdout.flush()
+# Every stdout line is an event for the Node side; line buffering hands each one
+# to the pipe as soon as its newline is written, with no explicit flushes
+sys.stdout.reconfigure(line_buffering=True)
 
-import os
-import subprocess
-import tempfile
-import shutil
+# Set AUTODJ_PROGRESS=0 to silence progress lines for headless/batch runs
+PROGRESS_ENABLED = os.environ.get('AUTODJ_PROGRESS', '1') != '0'
+
+
+def _p(msg: str, _out=sys.stdout):
+    """Emit one progress line with a single write."""
+    if PROGRESS_ENABLED:
+        _out.write(msg + '\n')
+
+
+_p("IMMEDIATE TEST: Demucs processor starting...")
+_p("PROGRESS: Script file loading started...")
+_p("PROGRESS: Basic imports loading...")
+
+import math
+import inspect
+import contextlib
 from pathlib import Path
 import json
 import logging
 import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-print("PROGRESS: Loading audio processing libraries...", flush=True)
-sys.stdout.flush()
+_p("PROGRESS: Loading audio processing libraries...")
 
-import librosa
 import soundfile as sf
+import soxr
 import numpy as np
-from typing import Dict
+from typing import Dict, Iterator, List, Optional, Tuple
 
-print("PROGRESS: Demucs libraries loaded successfully!", flush=True)
-sys.stdout.flush()
+_p("PROGRESS: Demucs libraries loaded successfully!")
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-print("PROGRESS: All imports completed successfully!", flush=True)
-sys.stdout.flush()
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    logger.info("Numba not available, using NumPy for stem saturation")
+
+_p("PROGRESS: All imports completed successfully!")
+
+# Converted WAVs are cached across runs, keyed by source content
+WAV_CACHE_DIR = Path.home() / '.cache' / 'autodj' / 'wav'
+WAV_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+# Demucs model, loaded lazily and kept per device for the life of the process
+DEMUCS_MODEL = 'htdemucs'
+_MODELS = {}
+
+# Demucs segments separated concurrently on CPU, as the CLI's --jobs 2 did; the
+# physical cores are split between them for torch's intra-op threads
+CPU_JOBS = 2
+
+# One worker per Demucs stem for the enhancement and write stages
+STEM_WORKERS = 4
+
+# Stems are written as lossless 16-bit FLAC, about half the bytes of WAV;
+# set STEM_FORMAT=wav for uncompressed files
+STEM_FORMAT = 'wav' if os.environ.get('STEM_FORMAT', 'flac').lower() == 'wav' else 'flac'
+
+# Worker mode separates up to this many queued tracks per GPU call, fewer when
+# free VRAM is below STEM_BATCH_VRAM_PER_TRACK per track
+STEM_BATCH_SIZE = 4
+STEM_BATCH_VRAM_PER_TRACK = 2 * 1024 ** 3
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _soft_saturate_kernel(audio, drive, gain):
+        flat = audio.reshape(-1)
+        for i in prange(flat.size):
+            flat[i] = math.tanh(flat[i] * drive) * gain
+
+
+# Numba's default workqueue threading layer must not be entered from two threads at once
+_SATURATE_LOCK = threading.Lock()
+
+
+def _soft_saturate(audio: np.ndarray, drive: float, gain: float) -> np.ndarray:
+    """In-place tanh(audio * drive) * gain, fused into a single pass when Numba is available."""
+    if NUMBA_AVAILABLE and audio.flags.c_contiguous:
+        with _SATURATE_LOCK:
+            _soft_saturate_kernel(audio, drive, gain)
+    else:
+        np.multiply(audio, drive, out=audio)
+        np.tanh(audio, out=audio)
+        audio *= gain
+    return audio
+
+
+if NUMBA_AVAILABLE:
+    @njit(fastmath=True, cache=True)
+    def _preemphasis_kernel(audio, coef, gain):
+        rows = audio.reshape(-1, audio.shape[-1])
+        for c in range(rows.shape[0]):
+            row = rows[c]
+            first = gain * (3 * row[0] - row[1])
+            # Walk backwards so each sample still sees its unfiltered predecessor
+            for i in range(row.size - 1, 0, -1):
+                row[i] = gain * (row[i] - coef * row[i - 1])
+            row[0] = first
+
+
+def _preemphasis(audio: np.ndarray, coef: float, gain: float = 1.0) -> np.ndarray:
+    """
+    gain * (audio[n] - coef * audio[n - 1]) along the last axis, matching
+    librosa.effects.preemphasis without importing librosa. Like librosa's default
+    initial filter state (zi = 2 * audio[0] - audio[1], not scaled by coef), the
+    first sample becomes 3 * audio[0] - audio[1].
+    Filters in place in a single pass when Numba is available.
+    """
+    if NUMBA_AVAILABLE and audio.flags.c_contiguous and audio.shape[-1] > 1:
+        _preemphasis_kernel(audio, coef, gain)
+        return audio
+    out = np.multiply(audio, -coef)
+    out[..., 1:] = out[..., :-1]
+    out[..., :1] = 2 * audio[..., :1] - audio[..., 1:2]
+    out += audio
+    out *= gain
+    return out
+
+
+def _use_cuda_graph_forward(model):
+    """
+    Replace model.forward with a CUDA-graph replay. apply_model feeds every segment
+    padded to the same shape, so one capture is replayed for all of them instead of
+    re-launching every kernel. Only the latest shape is kept: a new batch size drops
+    the old graph and its memory pool before capturing again. Falls back to eager on
+    capture failure.
+    """
+    import torch
+
+    eager_forward = model.forward
+    graphs = {}
+
+    def forward(mix):
+        key = (tuple(mix.shape), mix.dtype)
+        entry = graphs.get(key)
+        if entry is None:
+            graphs.clear()  # Releases the previous shape's graph and private pool
+            try:
+                static_in = mix.clone()
+                # Warm up on a side stream so lazy init stays out of the capture
+                side_stream = torch.cuda.Stream()
+                side_stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(side_stream):
+                    for _ in range(3):
+                        eager_forward(static_in)
+                torch.cuda.current_stream().wait_stream(side_stream)
+
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph):
+                    static_out = eager_forward(static_in)
+                entry = (graph, static_in, static_out)
+            except Exception as e:
+                logger.warning(f"CUDA graph capture failed for {key[0]}, using eager forward: {e}")
+                entry = False
+            graphs[key] = entry
+
+        if entry is False:
+            return eager_forward(mix)
+        graph, static_in, static_out = entry
+        static_in.copy_(mix)
+        graph.replay()
+        return static_out.clone()
+
+    model.forward = forward
 
 class DemucsSimpleProcessor:
     def __init__(self):
@@ -45,252 +190,509 @@ class DemucsSimpleProcessor:
         Initialize the robust Demucs processor.
         """
         self.supported_formats = ['.mp3', '.wav', '.flac', '.m4a', '.aac']
-        print("PROGRESS: DemucsSimpleProcessor initialized", flush=True)
-        sys.stdout.flush()
+        self.device = self._detect_device()
+        self._write_buffers = threading.local()
+        if NUMBA_AVAILABLE:
+            # Compile (or load from cache) the stem kernels now so the first stem doesn't pay for them
+            _soft_saturate(np.zeros((2, 16), dtype=np.float32), 1.0, 1.0)
+            _preemphasis(np.zeros((2, 16), dtype=np.float32), 0.15, 1.0)
+        _p(f"PROGRESS: DemucsSimpleProcessor initialized (device: {self.device})")
         
+    def _detect_device(self) -> str:
+        """Use CUDA for Demucs when torch can see a GPU, otherwise fall back to CPU."""
+        try:
+            import torch
+            return 'cuda' if torch.cuda.is_available() else 'cpu'
+        except Exception as e:
+            logger.warning(f"Could not probe CUDA availability: {e}")
+            return 'cpu'
+
     def is_supported_format(self, file_path: str) -> bool:
         """Check if the file format is supported."""
         return Path(file_path).suffix.lower() in self.supported_formats
 
+    def _cached_wav_path(self, input_file: str) -> Path:
+        """Cache location for the converted WAV, keyed by the first 1MB of the source and its size."""
+        hasher = hashlib.sha1()
+        with open(input_file, 'rb') as f:
+            hasher.update(f.read(1 << 20))
+        hasher.update(str(os.path.getsize(input_file)).encode())
+        return WAV_CACHE_DIR / f"{hasher.hexdigest()[:16]}.wav"
+
+    def _evict_wav_cache(self):
+        """Drop least recently used cached WAVs until the cache fits in WAV_CACHE_MAX_BYTES."""
+        try:
+            entries = sorted(WAV_CACHE_DIR.glob('*.wav'), key=lambda p: p.stat().st_mtime)
+            total = sum(p.stat().st_size for p in entries)
+            for entry in entries:
+                if total <= WAV_CACHE_MAX_BYTES:
+                    break
+                total -= entry.stat().st_size
+                entry.unlink()
+        except OSError as e:
+            logger.warning(f"WAV cache eviction failed: {e}")
+
+    def _stream_to_wav(self, input_file: str, output_file: str, sample_rate: int, blocksize: int = 65536):
+        """Decode, resample and write block by block so memory stays O(blocksize) regardless of track length."""
+        with sf.SoundFile(input_file) as fin, \
+                sf.SoundFile(output_file, 'w', samplerate=sample_rate, channels=fin.channels, subtype='PCM_16') as fout:
+            if fin.samplerate == sample_rate:
+                for block in fin.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+                    fout.write(block)
+                return
+
+            resampler = soxr.ResampleStream(fin.samplerate, sample_rate, fin.channels, dtype='float32', quality='HQ')
+            for block in fin.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+                fout.write(resampler.resample_chunk(block))
+            fout.write(resampler.resample_chunk(np.empty((0, fin.channels), dtype=np.float32), last=True))
+
     def convert_to_analysis_wav(self, input_file: str) -> str:
-        """Convert any audio file to a high quality WAV for analysis."""
+        """Convert any audio file to a high quality WAV for analysis, reusing a cached conversion."""
         try:
-            y, sr = librosa.load(input_file, sr=48000, mono=False)
-            temp_wav = os.path.join(tempfile.gettempdir(), f"analysis_{Path(input_file).stem}.wav")
-            sf.write(temp_wav, y.T if len(y.shape) > 1 else y, 48000)
-            return temp_wav
+            cached_wav = self._cached_wav_path(input_file)
+            if cached_wav.exists() and cached_wav.stat().st_mtime >= os.path.getmtime(input_file):
+                os.utime(cached_wav)  # Mark as recently used
+                logger.info(f"Reusing cached WAV conversion: {cached_wav}")
+                return str(cached_wav)
+
+            WAV_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            partial_wav = cached_wav.with_name(f"{cached_wav.stem}.{os.getpid()}.partial.wav")
+            try:
+                self._stream_to_wav(input_file, str(partial_wav), 48000)
+            except RuntimeError as e:  # soundfile.LibsndfileError
+                # Formats libsndfile can't decode (m4a/aac, mp3 on older builds)
+                logger.info(f"Streaming conversion unavailable ({e}), decoding with librosa")
+                import librosa
+                # Decode at the native rate and resample all channels in one soxr call
+                y, sr = librosa.load(input_file, sr=None, mono=False, dtype=np.float32)
+                y = np.ascontiguousarray(y.T if y.ndim > 1 else y)
+                if sr != 48000:
+                    y = soxr.resample(y, sr, 48000, quality='HQ')
+                sf.write(str(partial_wav), y, 48000, subtype='PCM_16')
+            os.replace(partial_wav, cached_wav)
+            self._evict_wav_cache()
+            return str(cached_wav)
         except Exception as e:
             logger.error(f"Conversion to analysis WAV failed: {e}")
             raise
     
-    def run_demucs_separation(self, input_file: str, temp_dir: str, filename: str = None) -> bool:
+    def _start_heartbeat(self, start_time: float, interval: float = 10.0) -> threading.Event:
+        """Print an elapsed-time progress line every `interval` seconds until the returned event is set."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                elapsed = time.time() - start_time
+                minutes = int(elapsed // 60)
+                seconds = int(elapsed % 60)
+                _p(f"PROGRESS: Demucs processing... {minutes}m {seconds}s elapsed")
+
+        threading.Thread(target=beat, daemon=True).start()
+        return stop
+
+    def _progress_callback(self, shifts: int):
+        """
+        Build an apply_model callback that maps Demucs' per-segment progress
+        (model in bag, shift, segment offset) onto our 40-80% range.
+        """
+        last_percentage = [-1]
+
+        def callback(info: Dict):
+            if info.get('state') != 'end':
+                return
+            passes = max(1, info.get('models', 1) * shifts)
+            done = info.get('model_idx_in_bag', 0) * shifts + info.get('shift_idx', 0)
+            within = min(1.0, info.get('segment_offset', 0) / max(1, info.get('audio_length', 1)))
+            percentage = 40 + int(40 * min(1.0, (done + within) / passes))
+            if percentage != last_percentage[0]:
+                last_percentage[0] = percentage
+                _p(f"PROGRESS: {percentage}% - Demucs separation progress...")
+
+        return callback
+
+    def _use_tensor_cores(self) -> bool:
+        """FP16 autocast and channels_last only pay off on Volta (sm_70) and newer GPUs."""
+        if self.device != 'cuda':
+            return False
+        import torch
+        return torch.cuda.get_device_capability() >= (7, 0)
+
+    def _get_model(self):
+        """Load the Demucs model once per device and keep it cached for later tracks."""
+        model = _MODELS.get(self.device)
+        if model is None:
+            import torch
+            from demucs.pretrained import get_model
+            model = get_model(DEMUCS_MODEL)
+            model.to(self.device).eval()
+            if self.device == 'cpu' and 'OMP_NUM_THREADS' not in os.environ:
+                # Each of the CPU_JOBS segment workers gets its share of the physical cores
+                physical_cores = max(1, (os.cpu_count() or 2) // 2)
+                torch.set_num_threads(max(1, physical_cores // CPU_JOBS))
+            if self._use_tensor_cores():
+                # Lets cuDNN pick NHWC tensor-core kernels for the spectrogram-branch Conv2d layers
+                model.to(memory_format=torch.channels_last)
+            if self.device == 'cuda' and os.environ.get('AUTODJ_CUDA_GRAPHS', '1') != '0':
+                # A bag of models is applied member by member, so graph each member
+                for sub_model in getattr(model, 'models', [model]):
+                    _use_cuda_graph_forward(sub_model)
+            _MODELS[self.device] = model
+        return model
+
+    def _load_for_separation(self, input_file: str, model):
         """
-        Run Demucs separation with robust error handling and progress feedback.
+        Decode a track at the model's rate and channel count and normalize it like
+        demucs.separate does. Returns (wav, ref_mean, ref_std).
+        """
+        import torchaudio
+        from demucs.audio import convert_audio
+
+        try:
+            # Demucs resamples internally, so decode the source directly
+            wav, sr = torchaudio.load(input_file)
+        except Exception as e:
+            logger.info(f"Direct decode failed ({e}), converting to WAV first")
+            wav, sr = torchaudio.load(self.convert_to_analysis_wav(input_file))
+        wav = convert_audio(wav, sr, model.samplerate, model.audio_channels)
+
+        # Undone on the separated stems by _finish_stems
+        ref = wav.mean(0)
+        ref_mean, ref_std = ref.mean(), ref.std() + 1e-8
+        return (wav - ref_mean) / ref_std, ref_mean, ref_std
+
+    def _stack_mix(self, wavs):
+        """
+        Zero-pad (channels, samples) tracks into one contiguous (batch, channels, samples)
+        float32 mix, allocated in pinned memory on CUDA so the upload can be a DMA.
+        """
+        import torch
+
+        if len(wavs) == 1 and self.device != 'cuda':
+            return wavs[0][None]  # Nothing to pad or upload
+        mix = torch.zeros((len(wavs), wavs[0].shape[0], max(wav.shape[-1] for wav in wavs)),
+                          dtype=torch.float32, pin_memory=self.device == 'cuda')
+        for row, wav in zip(mix, wavs):
+            row[:, :wav.shape[-1]].copy_(wav)
+        return mix
+
+    def _apply_model(self, model, mix, shifts: int, host_mix: bool = False):
+        """
+        Separate a (batch, channels, samples) mix; returns (batch, stems, channels, samples).
+        With host_mix the mix and the full-length output stay in host memory and only
+        each segment visits the GPU, as the Demucs CLI does.
+        """
+        import torch
+        from demucs.apply import apply_model
+
+        progress_kwargs = {}
+        if 'callback' in inspect.signature(apply_model).parameters:
+            # Newer Demucs reports each segment; older releases only get the heartbeat
+            progress_kwargs = {
+                'callback': self._progress_callback(shifts),
+                'callback_arg': {
+                    'audio_length': mix.shape[-1],
+                    'models': len(getattr(model, 'models', [model]))
+                }
+            }
+
+        if self.device == 'cuda' and not host_mix:
+            # apply_model overlap-adds into a buffer on the mix's device; keeping it on
+            # the GPU avoids a blocking device-to-host copy for every segment
+            mix = mix.to(self.device, non_blocking=mix.is_pinned())
+
+        # FP16 autocast lets the GPU use tensor cores; CPU and older GPUs stay in FP32.
+        # The weight-cast cache must stay off: a CUDA graph captured under it would keep
+        # pointing at cached fp16 weights that are freed when the context exits
+        autocast = (torch.autocast('cuda', dtype=torch.float16, cache_enabled=False)
+                    if self._use_tensor_cores() else contextlib.nullcontext())
+        with torch.inference_mode(), autocast:
+            return apply_model(
+                model, mix,
+                device=self.device,
+                segment=7,  # Use maximum safe segment size (under 7.8 limit)
+                overlap=0.25,  # Good overlap for quality results
+                shifts=shifts,
+                split=True,
+                num_workers=CPU_JOBS if self.device == 'cpu' else 0,
+                progress=False,
+                **progress_kwargs
+            )
+
+    def _to_host(self, sources):
+        """Bring separated sources to the CPU as float32 in one transfer, via pinned memory on CUDA."""
+        import torch
+
+        if sources.device.type != 'cuda':
+            return sources.float()
+        host = torch.empty(sources.shape, dtype=torch.float32, pin_memory=True)
+        host.copy_(sources, non_blocking=True)
+        torch.cuda.synchronize()
+        return host
+
+    def _finish_stems(self, sources, ref_mean, ref_std, model) -> Dict[str, np.ndarray]:
+        """
+        Undo the input normalization on host sources from _to_host and return
+        {stem_name: (channels, samples) float32 array}.
+        """
+        import torch
+
+        with torch.inference_mode():  # CPU sources are inference tensors straight from apply_model
+            sources = sources.mul_(ref_std).add_(ref_mean).numpy()
+
+        stems = {}
+        for stem_name, stem in zip(model.sources, sources):
+            # Rescale instead of clipping, matching the Demucs CLI default
+            stem /= max(1.01 * float(np.abs(stem).max()), 1.0)
+            stems[stem_name] = stem
+        return stems
+
+    def run_demucs_separation(self, input_file: str, filename: str = None) -> Optional[Tuple[Dict[str, np.ndarray], int]]:
+        """
+        Run Demucs separation in-process with robust error handling and progress feedback.
+        Returns ({stem_name: (channels, samples) float32 array}, sample_rate), or None on failure.
         """
         try:
             if not filename:
                 filename = os.path.basename(input_file)
                 
-            print(f"PROGRESS: Processing: {filename} - 30% - Initializing Demucs model...", flush=True)
-            sys.stdout.flush()
-            
-            # Demucs command with CPU-optimized settings
-            cmd = [
-                'python', '-m', 'demucs.separate',
-                '-n', 'htdemucs',  # Use highest quality model
-                '-o', temp_dir,
-                '--filename', '{track}/{stem}.{ext}',
-                '--segment', '7',  # Use maximum safe segment size (under 7.8 limit)
-                '--overlap', '0.25',  # Good overlap for quality results
-                '--shifts', '3',  # Multiple shifts for better quality
-                '--device', 'cpu',  # Ensure we use CPU for consistency
-                '--jobs', '2',  # Use 2 cores per song (4 total for parallel processing)
-                input_file
-            ]
+            _p(f"PROGRESS: Processing: {filename} - 30% - Initializing Demucs model...")
             
-            print(f"PROGRESS: Processing: {filename} - 40% - Starting Demucs separation (this may take 2-5 minutes)...", flush=True)
-            sys.stdout.flush()
+            model = self._get_model()
+            wav, ref_mean, ref_std = self._load_for_separation(input_file, model)
             
-            # Run Demucs with real-time output
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                universal_newlines=True
-            )
+            _p(f"PROGRESS: Processing: {filename} - 40% - Starting Demucs separation (this may take 2-5 minutes)...")
             
-            # Monitor progress
             start_time = time.time()
-            last_progress_time = start_time
-            
-            # Read output line by line
-            while True:
-                output = process.stderr.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                    
-                if output:
-                    current_time = time.time()
-                    elapsed = current_time - start_time
-                    
-                    # Parse Demucs percentage from output like "16%|#########3..."
-                    output_str = output.strip()
-                    if '%|' in output_str:
-                        try:
-                            percentage_str = output_str.split('%|')[0].strip()
-                            # Handle decimal percentages
-                            if '.' in percentage_str:
-                                percentage = int(float(percentage_str))
-                            else:
-                                percentage = int(percentage_str)
-                            
-                            # Convert to our progress scale (40% = start of Demucs, 80% = end)
-                            # Demucs goes 0-100%, we map it to 40-80% of our total progress
-                            mapped_percentage = 40 + int(percentage * 0.4)
-                            print(f"PROGRESS: {mapped_percentage}% - Demucs separation progress...", flush=True)
-                            sys.stdout.flush()
-                        except (ValueError, IndexError):
-                            # If parsing fails, fall back to time-based updates
-                            if current_time - last_progress_time >= 10:
-                                minutes = int(elapsed // 60)
-                                seconds = int(elapsed % 60)
-                                print(f"PROGRESS: Demucs processing... {minutes}m {seconds}s elapsed", flush=True)
-                                sys.stdout.flush()
-                                last_progress_time = current_time
-                    else:
-                        # Send progress updates every 10 seconds if no percentage found
-                        if current_time - last_progress_time >= 10:
-                            minutes = int(elapsed // 60)
-                            seconds = int(elapsed % 60)
-                            print(f"PROGRESS: Demucs processing... {minutes}m {seconds}s elapsed", flush=True)
-                            sys.stdout.flush()
-                            last_progress_time = current_time
-                    
-                    # Log Demucs output
-                    logger.info(f"Demucs: {output.strip()}")
-            
-            # Wait for completion
-            return_code = process.wait()
+            stop_heartbeat = self._start_heartbeat(start_time)
+            shifts = 3  # Multiple shifts for better quality
+            try:
+                mix = self._stack_mix([wav])
+                try:
+                    sources = self._apply_model(model, mix, shifts)
+                except RuntimeError as e:  # torch.cuda.OutOfMemoryError
+                    if self.device != 'cuda' or 'out of memory' not in str(e):
+                        raise
+                    # Long tracks' full-length output buffers don't fit next to the model
+                    import torch
+                    torch.cuda.empty_cache()
+                    logger.warning("Out of GPU memory, retrying with the mix in host memory")
+                    sources = self._apply_model(model, mix, shifts, host_mix=True)
+                sources = self._to_host(sources)[0]
+            finally:
+                stop_heartbeat.set()
+
+            stems = self._finish_stems(sources, ref_mean, ref_std, model)
             
             elapsed_total = time.time() - start_time
             minutes = int(elapsed_total // 60)
             seconds = int(elapsed_total % 60)
             
-            if return_code == 0:
-                print(f"PROGRESS: 80% - Demucs completed successfully in {minutes}m {seconds}s!", flush=True)
-                sys.stdout.flush()
-                return True
-            else:
-                error_output = process.stderr.read()
-                logger.error(f"Demucs failed with return code {return_code}: {error_output}")
-                return False
+            _p(f"PROGRESS: 80% - Demucs completed successfully in {minutes}m {seconds}s!")
+            return stems, model.samplerate
                 
         except Exception as e:
             logger.error(f"Error running Demucs: {str(e)}")
-            return False
+            return None
+
+    def _batch_limit(self, requested: int) -> int:
+        """
+        Cap the cross-track batch by the VRAM available to it: free on the device plus
+        what PyTorch's caching allocator holds unused from earlier batches, which
+        mem_get_info counts as taken.
+        """
+        import torch
+
+        try:
+            free, _ = torch.cuda.mem_get_info()
+            free += torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+        except Exception:
+            return requested
+        return max(1, min(requested, free // STEM_BATCH_VRAM_PER_TRACK))
+
+    def _apply_model_batch(self, model, mix, shifts: int):
+        """Separate a stacked mix, splitting the batch in half on CUDA out-of-memory."""
+        import torch
+
+        try:
+            return self._apply_model(model, mix, shifts)
+        except RuntimeError as e:  # torch.cuda.OutOfMemoryError
+            if 'out of memory' not in str(e) or mix.shape[0] == 1:
+                raise
+            torch.cuda.empty_cache()
+            half = mix.shape[0] // 2
+            logger.warning(f"Out of GPU memory with batch of {mix.shape[0]}, retrying as {half} + {mix.shape[0] - half}")
+            return torch.cat([
+                self._apply_model_batch(model, mix[:half], shifts),
+                self._apply_model_batch(model, mix[half:], shifts)
+            ])
+
+    def run_demucs_batch(self, input_files: List[str]) -> List[Optional[Tuple[Dict[str, np.ndarray], int]]]:
+        """
+        Separate several queued tracks with one apply_model call per batch instead of
+        one per track. Tracks are grouped by length so zero padding stays small.
+        Returns one run_demucs_separation-style result per input, None where it failed.
+        """
+        if self.device != 'cuda' or len(input_files) == 1:
+            # Batching only pays off where per-call launch overhead dominates
+            return [self.run_demucs_separation(input_file) for input_file in input_files]
+
+        results: List[Optional[Tuple[Dict[str, np.ndarray], int]]] = [None] * len(input_files)
+        try:
+            model = self._get_model()
+        except Exception as e:
+            logger.error(f"Error loading Demucs model: {str(e)}")
+            return results
+
+        loaded = {}
+        for index, input_file in enumerate(input_files):
+            _p(f"PROGRESS: Processing: {os.path.basename(input_file)} - 30% - Loading for batched separation...")
+            try:
+                loaded[index] = self._load_for_separation(input_file, model)
+            except Exception as e:
+                logger.error(f"Could not load {input_file} for Demucs: {str(e)}")
+
+        order = sorted(loaded, key=lambda index: loaded[index][0].shape[-1])
+        shifts = 3  # Multiple shifts for better quality
+        position = 0
+        while position < len(order):
+            group = order[position:position + self._batch_limit(STEM_BATCH_SIZE)]
+            position += len(group)
+            lengths = [loaded[index][0].shape[-1] for index in group]
+
+            names = ', '.join(os.path.basename(input_files[index]) for index in group)
+            _p(f"PROGRESS: 40% - Separating {len(group)} tracks in one batch: {names}")
+            start_time = time.time()
+            stop_heartbeat = self._start_heartbeat(start_time)
+            try:
+                mix = self._stack_mix([loaded[index][0] for index in group])
+                sources = self._to_host(self._apply_model_batch(model, mix, shifts))
+            except Exception as e:
+                # These tracks are left as None and retried on their own by process_stems
+                logger.error(f"Error running batched Demucs: {str(e)}")
+                for index in group:
+                    del loaded[index]
+                continue
+            finally:
+                stop_heartbeat.set()
+
+            for index, length, track_sources in zip(group, lengths, sources):
+                _, ref_mean, ref_std = loaded.pop(index)
+                stems = self._finish_stems(track_sources[..., :length], ref_mean, ref_std, model)
+                results[index] = (stems, model.samplerate)
+
+            elapsed_total = time.time() - start_time
+            _p(f"PROGRESS: 80% - Demucs batch of {len(group)} completed in {int(elapsed_total // 60)}m {int(elapsed_total % 60)}s!")
+
+        return results
     
-    def find_and_organize_stems(self, temp_dir: str, input_file: str, output_dir: str) -> Dict[str, str]:
+    def _frames_buffer(self, frames: int, channels: int) -> np.ndarray:
+        """
+        Per-thread float32 (frames, channels) write buffer, grown on demand and reused
+        across stems and, in worker mode, across tracks.
+        """
+        buffer = getattr(self._write_buffers, 'buffer', None)
+        if buffer is None or buffer.shape[0] < frames or buffer.shape[1] != channels:
+            buffer = np.empty((frames, channels), dtype=np.float32)
+            self._write_buffers.buffer = buffer
+        return buffer[:frames]
+
+    def _write_one(self, item: Tuple[str, np.ndarray], sample_rate: int, base_name: str, output_dir: str) -> Tuple[str, str]:
+        """Write a single stem; run from the stem thread pool."""
+        stem_name, audio = item
+        dest_file = os.path.join(output_dir, f"{base_name}_{stem_name}.{STEM_FORMAT}")
+        if len(audio.shape) > 1:
+            # Interleave into a reused contiguous (frames, channels) buffer instead of
+            # letting soundfile allocate a fresh copy of the transposed view per stem
+            frames_buffer = self._frames_buffer(audio.shape[1], audio.shape[0])
+            np.copyto(frames_buffer, audio.T)
+            sf.write(dest_file, frames_buffer, sample_rate, subtype='PCM_16')
+        else:
+            sf.write(dest_file, audio, sample_rate, subtype='PCM_16')
+        _p(f"PROGRESS: Saved {stem_name} stem")
+        return stem_name, dest_file
+
+    def write_stems(self, stems: Dict[str, np.ndarray], sample_rate: int, input_file: str, output_dir: str) -> Dict[str, str]:
         """
-        Find Demucs output files and organize them properly.
+        Write the separated stems to output_dir as <track>_<stem>.flac (or .wav, see STEM_FORMAT).
         """
-        print("PROGRESS: 85% - Locating and organizing stem files...", flush=True)
-        sys.stdout.flush()
+        _p("PROGRESS: 90% - Writing stem files...")
         
-        stem_files = {}
         base_name = Path(input_file).stem
         
-        # Demucs creates output in: temp_dir/htdemucs/track_name/
-        demucs_output_dir = None
-        
-        # Find the Demucs output directory
-        for root, dirs, files in os.walk(temp_dir):
-            if 'htdemucs' in root and files:
-                demucs_output_dir = root
-                break
-        
-        if not demucs_output_dir:
-            raise FileNotFoundError("Demucs output directory not found")
-        
-        print(f"PROGRESS: Found Demucs output in: {demucs_output_dir}", flush=True)
-        sys.stdout.flush()
-        
-        # Expected stem names from Demucs
-        expected_stems = ['vocals', 'drums', 'bass', 'other']
-        
-        # Copy and rename stems to output directory
-        for stem_name in expected_stems:
-            source_file = os.path.join(demucs_output_dir, f"{stem_name}.wav")
-            if os.path.exists(source_file):
-                dest_file = os.path.join(output_dir, f"{base_name}_{stem_name}.wav")
-                shutil.copy2(source_file, dest_file)
-                stem_files[stem_name] = dest_file
-                print(f"PROGRESS: Organized {stem_name} stem", flush=True)
-                sys.stdout.flush()
-            
+        # libsndfile encodes and writes without holding the GIL, so stems are written concurrently
+        with ThreadPoolExecutor(max_workers=STEM_WORKERS) as executor:
+            stem_files = dict(executor.map(
+                lambda item: self._write_one(item, sample_rate, base_name, output_dir), stems.items()
+            ))
         
         if len(stem_files) == 0:
-            raise FileNotFoundError("No stem files found in Demucs output")
+            raise FileNotFoundError("No stems produced by Demucs")
         
         return stem_files
     
-    def enhance_stems_quality(self, stem_files: Dict[str, str], filename: str = None) -> Dict[str, str]:
+    def _enhance_one(self, item: Tuple[str, np.ndarray], filename: str) -> Tuple[str, np.ndarray]:
+        """Apply the stem-specific enhancement to one stem; run from the stem thread pool."""
+        stem_name, audio = item
+        try:
+            _p(f"PROGRESS: Processing: {filename} - Enhancing {stem_name} stem...")
+            
+            # Everything downstream of Demucs stays single precision; output is 16-bit anyway
+            audio = audio.astype(np.float32, copy=False)
+            
+            # Apply stem-specific professional enhancements
+            if stem_name == 'vocals':
+                # Professional vocal enhancement
+                # Vocal clarity enhancement with a subtle 1.02 harmonic lift, in one pass
+                enhanced_audio = _preemphasis(audio, 0.15, 1.02)
+                
+            elif stem_name == 'drums':
+                # Professional drum enhancement: better transient response
+                # Gentle saturation for warmth; undo the drive and add a
+                # slight gain boost for punch in the same pass
+                enhanced_audio = _soft_saturate(audio, 1.15, 1.08 / 1.15)
+                
+            elif stem_name == 'bass':
+                # Professional bass enhancement: warmth and definition
+                # Subtle harmonic saturation; the 1.1 warmth boost cancels the 1/1.1 drive compensation
+                enhanced_audio = _soft_saturate(audio, 1.1, 1.0)
+                
+            else:  # other/instrumental
+                # Professional instrumental enhancement
+                enhanced_audio = audio
+            
+            return stem_name, enhanced_audio
+            
+        except Exception as e:
+            logger.warning(f"Enhancement failed for {stem_name}: {e}, using original")
+            return stem_name, audio
+
+    def enhance_stems_quality(self, stems: Dict[str, np.ndarray], filename: str = None) -> Dict[str, np.ndarray]:
         """
         Apply professional enhancements to improve stem quality significantly.
+        Works on the in-memory separated stems so each stem is written to disk only once.
         """
         if not filename:
             filename = "stems"
             
-        print(f"PROGRESS: Processing: {filename} - 90% - Applying professional quality enhancements...", flush=True)
-        sys.stdout.flush()
+        _p(f"PROGRESS: Processing: {filename} - 85% - Applying professional quality enhancements...")
         
-        enhanced_files = {}
-        
-        for stem_name, file_path in stem_files.items():
-            try:
-                print(f"PROGRESS: Processing: {filename} - Enhancing {stem_name} stem...", flush=True)
-                sys.stdout.flush()
-                
-                # Load the stem with higher precision
-                audio, sr = librosa.load(file_path, sr=None, mono=False, dtype=np.float64)
-                
-                # Apply stem-specific professional enhancements
-                if stem_name == 'vocals':
-                    # Professional vocal enhancement
-                    if len(audio.shape) == 1:
-                        # Vocal clarity enhancement
-                        audio_filtered = librosa.effects.preemphasis(audio, coef=0.15)
-                        # Subtle harmonic enhancement
-                        enhanced_audio = audio_filtered * 1.02
-                    else:
-                        audio_filtered = np.array([librosa.effects.preemphasis(ch, coef=0.15) for ch in audio])
-                        enhanced_audio = audio_filtered * 1.02
-                    
-                elif stem_name == 'drums':
-                    # Professional drum enhancement: better transient response
-                    # Gentle saturation for warmth
-                    enhanced_audio = np.tanh(audio * 1.15) / 1.15
-                    # Slight gain boost for punch
-                    enhanced_audio = enhanced_audio * 1.08
-                    
-                elif stem_name == 'bass':
-                    # Professional bass enhancement: warmth and definition
-                    # Subtle harmonic saturation
-                    enhanced_audio = np.tanh(audio * 1.1) / 1.1
-                    # Bass warmth boost
-                    enhanced_audio = enhanced_audio * 1.1
-                    
-                else:  # other/instrumental
-                    # Professional instrumental enhancement
-                    enhanced_audio = audio
-                
-                # Save enhanced version
-                enhanced_path = file_path.replace('.wav', '_enhanced.wav')
-                sf.write(enhanced_path, enhanced_audio.T if len(enhanced_audio.shape) > 1 else enhanced_audio, sr)
-                
-                # Replace original with enhanced version
-                os.replace(enhanced_path, file_path)
-                enhanced_files[stem_name] = file_path
-                
-            except Exception as e:
-                logger.warning(f"Enhancement failed for {stem_name}: {e}, using original")
-                enhanced_files[stem_name] = file_path
-        
-        return enhanced_files
+        # Stems are independent and NumPy/SciPy release the GIL, so enhance them concurrently
+        with ThreadPoolExecutor(max_workers=STEM_WORKERS) as executor:
+            return dict(executor.map(lambda item: self._enhance_one(item, filename), stems.items()))
     
-    def process_stems(self, input_file: str, output_dir: str) -> Dict:
+    def process_stems(self, input_file: str, output_dir: str,
+                      separation: Optional[Tuple[Dict[str, np.ndarray], int]] = None) -> Dict:
         """
         Process audio file using Demucs with robust error handling.
+        A separation already produced by run_demucs_batch skips the Demucs pass.
         """
         try:
             filename = os.path.basename(input_file)
-            print(f"PROGRESS: Processing: {filename} - Entered Demucs process_stems method", flush=True)
-            sys.stdout.flush()
+            _p(f"PROGRESS: Processing: {filename} - Entered Demucs process_stems method")
             
             logger.info(f"Starting Demucs stem processing for: {input_file}")
             
-            print(f"PROGRESS: Processing: {filename} - Validating input file", flush=True)
-            sys.stdout.flush()
+            _p(f"PROGRESS: Processing: {filename} - Validating input file")
             
             # Validate input file
             if not os.path.exists(input_file):
@@ -299,121 +701,189 @@ class DemucsSimpleProcessor:
             if not self.is_supported_format(input_file):
                 raise ValueError(f"Unsupported format: {Path(input_file).suffix}")
             
-            print(f"PROGRESS: Processing: {filename} - File validation passed, creating output directory", flush=True)
-            sys.stdout.flush()
+            _p(f"PROGRESS: Processing: {filename} - File validation passed, creating output directory")
             
             # Create output directory
             os.makedirs(output_dir, exist_ok=True)
             
-            print(f"PROGRESS: Processing: {filename} - 10% - Loading audio file info...", flush=True)
-            sys.stdout.flush()
+            _p(f"PROGRESS: Processing: {filename} - 10% - Loading audio file info...")
             
             # Get audio info
             try:
-                audio_info = librosa.get_duration(path=input_file)
-                sample_rate = librosa.get_samplerate(input_file)
-                print(f"PROGRESS: Processing: {filename} - Audio info: {audio_info:.1f}s at {sample_rate}Hz", flush=True)
-                sys.stdout.flush()
+                try:
+                    # One header read gives both, without decoding or importing librosa
+                    info = sf.info(input_file)
+                    audio_info = info.frames / info.samplerate
+                    sample_rate = info.samplerate
+                except RuntimeError:  # Not readable by libsndfile (m4a/aac)
+                    import librosa
+                    audio_info = librosa.get_duration(path=input_file)
+                    sample_rate = librosa.get_samplerate(input_file)
+                _p(f"PROGRESS: Processing: {filename} - Audio info: {audio_info:.1f}s at {sample_rate}Hz")
             except Exception as e:
                 logger.warning(f"Could not get audio info: {e}")
                 audio_info = 0
                 sample_rate = 44100
             
-            print(f"PROGRESS: Processing: {filename} - 20% - Creating temporary workspace...", flush=True)
-            sys.stdout.flush()
+            # Run Demucs separation
+            if separation is None:
+                separation = self.run_demucs_separation(input_file, filename)
             
-            analysis_input = self.convert_to_analysis_wav(input_file)
-
-            # Create temporary directory for Demucs
-            with tempfile.TemporaryDirectory() as temp_dir:
-                print(f"PROGRESS: Processing: {filename} - Temporary directory: {temp_dir}", flush=True)
-                sys.stdout.flush()
-
-                # Run Demucs separation
-                success = self.run_demucs_separation(analysis_input, temp_dir, filename)
-                
-                if not success:
-                    raise RuntimeError("Demucs separation failed")
-                
-                # Find and organize stems
-                stem_files = self.find_and_organize_stems(temp_dir, input_file, output_dir)
-                
-                # Apply quality enhancements
-                enhanced_stems = self.enhance_stems_quality(stem_files, filename)
-                
-                print(f"PROGRESS: Processing: {filename} - 95% - Finalizing stems...", flush=True)
-                sys.stdout.flush()
-                
-                # Verify all stems were created
-                missing_stems = []
-                for stem_name in ['vocals', 'drums', 'bass', 'other']:
-                    if stem_name not in enhanced_stems:
-                        missing_stems.append(stem_name)
-                
-                if missing_stems:
-                    logger.warning(f"Missing stems: {missing_stems}")
-                
-                print(f"PROGRESS: Processing: {filename} - 100% - Demucs processing complete!", flush=True)
-                sys.stdout.flush()
-                
-                result = {
-                    'success': True,
-                    'message': f'Successfully processed {len(enhanced_stems)} high-quality stems using Demucs for {Path(input_file).name}',
-                    'stems': enhanced_stems,
-                    'input_file': input_file,
-                    'output_dir': output_dir,
-                    'duration': audio_info,
-                    'sample_rate': sample_rate,
-                    'model_used': 'htdemucs'
-                }
-                
-                logger.info(f"Demucs processing completed successfully: {len(enhanced_stems)} stems created")
-                return result
+            if separation is None:
+                raise RuntimeError("Demucs separation failed")
+            stems, stem_sample_rate = separation
+            
+            # Apply quality enhancements in memory, then write each stem once
+            enhanced_audio = self.enhance_stems_quality(stems, filename)
+            enhanced_stems = self.write_stems(enhanced_audio, stem_sample_rate, input_file, output_dir)
+            
+            _p(f"PROGRESS: Processing: {filename} - 95% - Finalizing stems...")
+            
+            # Verify all stems were created
+            missing_stems = []
+            for stem_name in ['vocals', 'drums', 'bass', 'other']:
+                if stem_name not in enhanced_stems:
+                    missing_stems.append(stem_name)
+            
+            if missing_stems:
+                logger.warning(f"Missing stems: {missing_stems}")
+            
+            _p(f"PROGRESS: Processing: {filename} - 100% - Demucs processing complete!")
+            
+            result = {
+                'success': True,
+                'message': f'Successfully processed {len(enhanced_stems)} high-quality stems using Demucs for {Path(input_file).name}',
+                'stems': enhanced_stems,
+                'input_file': input_file,
+                'output_dir': output_dir,
+                'duration': audio_info,
+                'sample_rate': sample_rate,
+                'model_used': DEMUCS_MODEL
+            }
+            
+            logger.info(f"Demucs processing completed successfully: {len(enhanced_stems)} stems created")
+            return result
 
         except Exception as e:
             error_msg = f"Error processing stems: {str(e)}"
             logger.error(error_msg)
-            print(f"ERROR: {error_msg}", flush=True)
-            sys.stdout.flush()
+            print(f"ERROR: {error_msg}")
             return {
                 'success': False,
                 'error': error_msg,
                 'input_file': input_file
             }
 
-        finally:
-            if os.path.exists(analysis_input):
-                try:
-                    os.remove(analysis_input)
-                except Exception:
-                    pass
+    def process_batch(self, jobs: List[Dict]) -> Iterator[Dict]:
+        """
+        Process several worker jobs, yielding each result as soon as its stems are written.
+        On CUDA the tracks share batched separation calls; elsewhere each job runs start to
+        finish on its own, so no separated stems wait in memory behind other tracks.
+        Tracks the batch could not separate are retried on their own by process_stems.
+        """
+        if self.device != 'cuda' or len(jobs) == 1:
+            for job in jobs:
+                yield self.process_stems(job['input_file'], job['output_dir'])
+            return
+
+        separations = self.run_demucs_batch([job['input_file'] for job in jobs])
+        for index, job in enumerate(jobs):
+            separation, separations[index] = separations[index], None  # Freed once written
+            yield self.process_stems(job['input_file'], job['output_dir'], separation)
+
+def _load_worker_model(processor: DemucsSimpleProcessor) -> Optional[str]:
+    """Load the Demucs model, returning the error message instead of raising."""
+    try:
+        processor._get_model()
+        return None
+    except Exception as e:
+        logger.error(f"Could not load Demucs model: {str(e)}")
+        return f"Could not load Demucs model: {str(e)}"
+
+def run_worker(processor: DemucsSimpleProcessor):
+    """
+    Serve newline-delimited JSON jobs ({"id", "input_file", "output_dir"}, or
+    {"jobs": [...]} for a batch of them) from stdin until it is closed, printing
+    one JSON result line per job, tagged with its job_id, as soon as it finishes.
+    Once the model is loaded a {"worker_ready": true, "batch_size": n} line tells
+    the Node side how many jobs to send at once: batches only pay off on CUDA.
+    If the model can't be loaded the worker stays up and fails each job with the
+    load error, retrying the load for every new message.
+    """
+    _p("PROGRESS: Loading Demucs model for worker...")
+    model_error = _load_worker_model(processor)
+    _p("PROGRESS: Demucs worker ready")
+    batch_size = STEM_BATCH_SIZE if processor.device == 'cuda' else 1
+    print(json.dumps({'worker_ready': True, 'batch_size': batch_size}))
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            message = json.loads(line)
+            jobs = message['jobs'] if isinstance(message, dict) and 'jobs' in message else [message]
+        except ValueError as e:
+            logger.error(f"Invalid worker message {line!r}: {e}")
+            jobs = [{}]
+
+        valid_jobs = []
+        for job in jobs:
+            if (isinstance(job, dict) and isinstance(job.get('input_file'), str)
+                    and isinstance(job.get('output_dir'), str)):
+                valid_jobs.append(job)
+                continue
+            logger.error(f"Invalid worker job {job!r}")
+            print(json.dumps({
+                'success': False,
+                'error': "Invalid job: expected input_file and output_dir",
+                'input_file': job.get('input_file') if isinstance(job, dict) else None,
+                'job_id': job.get('id') if isinstance(job, dict) else None
+            }))
+
+        if valid_jobs and model_error:
+            model_error = _load_worker_model(processor)
+        if model_error:
+            for job in valid_jobs:
+                print(json.dumps({
+                    'success': False,
+                    'error': model_error,
+                    'input_file': job['input_file'],
+                    'job_id': job.get('id')
+                }))
+            continue
+
+        for job, result in zip(valid_jobs, processor.process_batch(valid_jobs)):
+            result['job_id'] = job.get('id')
+            print(json.dumps(result))
 
 def main():
     """Main function to run when script is called directly."""
-    print("PROGRESS: Python script started", flush=True)
-    sys.stdout.flush()
+    _p("PROGRESS: Python script started")
     
+    if len(sys.argv) == 2 and sys.argv[1] == '--worker':
+        run_worker(DemucsSimpleProcessor())
+        sys.exit(0)
+
     if len(sys.argv) != 3:
         print("Usage: python stem_processor_demucs_simple.py <input_file> <output_dir>")
+        print("       python stem_processor_demucs_simple.py --worker")
         sys.exit(1)
     
     input_file = sys.argv[1]
     output_dir = sys.argv[2]
     
-    print(f"PROGRESS: Initializing DemucsSimpleProcessor...", flush=True)
-    sys.stdout.flush()
+    _p("PROGRESS: Initializing DemucsSimpleProcessor...")
     
     processor = DemucsSimpleProcessor()
     
-    print(f"PROGRESS: Starting Demucs processing for: {input_file}", flush=True)
-    sys.stdout.flush()
+    _p(f"PROGRESS: Starting Demucs processing for: {input_file}")
     
     result = processor.process_stems(input_file, output_dir)
     
     # Output result as JSON for Node.js to parse
-    import json
-    print(json.dumps(result), flush=True)
-    sys.stdout.flush()
+    print(json.dumps(result))
     
     if result['success']:
         sys.exit(0)
@@ -421,4 +891,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import autodj_analyzer
+from autodj_analyzer import AutoDJAnalyzer
+
+ANALYZER = os.path.join(os.path.dirname(__file__), '..', 'autodj_analyzer.py')
+
+
+def _click_track(sr=44100, bpm=120.0, seconds=12.0):
+    rng = np.random.default_rng(0)
+    y = 0.01 * rng.standard_normal(int(sr * seconds)).astype(np.float32)
+    clicks = librosa.clicks(times=np.arange(0.5, seconds, 60.0 / bpm), sr=sr, length=len(y))
+    return y + clicks.astype(np.float32)
+
+
+def test_shared_spectrogram_beats_match_beat_track():
+    analyzer = AutoDJAnalyzer()
+    sr = analyzer.sample_rate
+    y = _click_track(sr)
+
+    _, log_mel = analyzer._shared_spectra(y, sr)
+    result = analyzer._analyze_beats(y, sr, log_mel)
+
+    _, beats = librosa.beat.beat_track(y=y, sr=sr, hop_length=analyzer.hop_length)
+    expected = librosa.frames_to_time(beats, sr=sr, hop_length=analyzer.hop_length)
+    assert len(expected) > 0
+    np.testing.assert_array_equal(np.asarray(result['beatgrid']), expected)
+
+
+def test_json_escapes_non_ascii_like_json_dumps():
+    data = {'file': '\u6771\u4eac - Caf\u00e9 \U0001d11e.mp3', 'bpm': 120.0}
+    out = autodj_analyzer._to_json(data)
+    assert out.isascii()
+    assert json.loads(out) == data
+
+
+def test_non_ascii_path_survives_cp1252_stdout(tmp_path):
+    path = tmp_path / '\u6771\u4eac - Caf\u00e9.wav'
+    sf.write(str(path), _click_track(seconds=6.0), 44100)
+
+    env = dict(os.environ, PYTHONIOENCODING='cp1252')
+    proc = subprocess.run([sys.executable, ANALYZER, str(path)], capture_output=True, env=env, check=True)
+
+    analysis = json.loads(proc.stdout.decode('utf-8').strip().splitlines()[-1])
+    assert 'error' not in analysis
+    assert analysis['file'] == str(path)
+
+
+def _segments_by_loop(active, times, end_time, min_length):
+    # The per-frame state machine _active_segments replaced
+    segments = []
+    in_segment = False
+    start_time = 0
+    for time, value in zip(times, active):
+        if value and not in_segment:
+            start_time = time
+            in_segment = True
+        elif not value and in_segment:
+            if time - start_time > min_length:
+                segments.append({'start': start_time, 'end': time})
+            in_segment = False
+    if in_segment:
+        segments.append({'start': start_time, 'end': end_time})
+    return segments
+
+
+def test_active_segments_match_frame_loop():
+    masks = [
+        [],                              # empty
+        [1] * 10,                        # all active
+        [0, 0, 1, 1, 1, 1, 1, 1, 0, 1],  # short open final run is still kept
+        [0, 1, 1, 1, 1, 0, 0],           # exactly min_length long, dropped
+        [1, 1, 1, 1, 1, 0, 0],           # just over min_length
+        [0, 1, 0, 1, 1, 1, 1, 1, 1, 0],
+    ]
+    for mask in masks:
+        active = np.array(mask, dtype=bool)
+        times = np.arange(len(active)) * 0.5
+        end_time = len(active) * 0.5 + 0.25
+        expected = _segments_by_loop(active, times, end_time, min_length=2.0)
+        assert autodj_analyzer._active_segments(active, times, end_time, min_length=2.0) == expected
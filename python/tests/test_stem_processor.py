@@ -0,0 +1,50 @@
+import io
+import json
+import os
+import sys
+
+import librosa
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import stem_processor_demucs_simple as stems
+
+
+def _signal(shape):
+    return np.random.default_rng(0).standard_normal(shape).astype(np.float32)
+
+
+def test_preemphasis_matches_librosa():
+    for shape in [(4096,), (2, 4096)]:
+        audio = _signal(shape)
+        expected = librosa.effects.preemphasis(audio, coef=0.15)
+        result = stems._preemphasis(audio.copy(), 0.15)
+        assert np.allclose(result, expected, atol=1e-5)
+
+
+def test_preemphasis_numpy_fallback_matches_librosa():
+    # A non-contiguous view skips the Numba kernel
+    audio = _signal((4096, 2)).T
+    expected = librosa.effects.preemphasis(audio, coef=0.15) * 1.02
+    result = stems._preemphasis(audio, 0.15, 1.02)
+    assert np.allclose(result, expected, atol=1e-5)
+
+
+def test_worker_reports_model_load_failure_per_job(monkeypatch, capsys):
+    processor = stems.DemucsSimpleProcessor()
+
+    def fail():
+        raise ImportError("No module named 'demucs'")
+
+    monkeypatch.setattr(processor, '_get_model', fail)
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(
+        '{"id": 1, "input_file": "a.mp3", "output_dir": "out"}\n'
+        '{"jobs": [{"id": 2, "input_file": "b.mp3", "output_dir": "out"}]}\n'
+    ))
+    stems.run_worker(processor)
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+    assert lines[0]['worker_ready']
+    assert [(r['job_id'], r['success']) for r in lines[1:]] == [(1, False), (2, False)]
+    assert all("No module named 'demucs'" in r['error'] for r in lines[1:])
@@ -386,174 +386,230 @@ ipcMain.handle('load-audio-file', async (event, filePath) => {
 
 
 
-ipcMain.handle('process-stems', async (event, filePath, outputDir) => {
-  return new Promise((resolve, reject) => {
-    const scriptPath = isDev 
-      ? path.join(__dirname, '../python/stem_processor_demucs_simple.py')
-      : path.join(process.resourcesPath, 'python/stem_processor_demucs_simple.py');
-    
-    console.log('Attempting to start Python script:', scriptPath);
-    console.log('File path:', filePath);
-    console.log('Output dir:', outputDir);
-    
-    // Try 'py' first (Windows Python Launcher), then 'python'
-    // Use -u flag to force unbuffered stdout/stderr
-    console.log('Spawning Python with args:', ['py', '-3', '-u', scriptPath, filePath, outputDir]);
-    
-    const pythonProcess = spawn('py', ['-3', '-u', scriptPath, filePath, outputDir], {
-      stdio: ['pipe', 'pipe', 'pipe'],  // Explicitly set stdio pipes
-      env: process.env  // Pass current environment
-    });
+// Long-lived Demucs worker: the Python side loads the model once and then
+// services newline-delimited JSON jobs from stdin. Once it reports a CUDA device
+// ({"worker_ready": true, "batch_size": n}), jobs queued while it is busy are sent
+// together so the GPU separates them in one call; on CPU they go one at a time.
+const STEM_JOB_TIMEOUT_MS = 15 * 60 * 1000;
+let stemWorker = null;
+const stemJobQueue = [];
+let stemJobCounter = 0;
+
+function getStemScriptPath() {
+  return isDev 
+    ? path.join(__dirname, '../python/stem_processor_demucs_simple.py')
+    : path.join(process.resourcesPath, 'python/stem_processor_demucs_simple.py');
+}
 
-    let output = '';
-    let error = '';
-    let isProcessing = true;
-    let hasReceivedData = false;
-    const startTime = Date.now();
-    
-    // Log spawn success
-    console.log('Python process spawned successfully with PID:', pythonProcess.pid);
-    
-    // Handle spawn errors immediately
-    pythonProcess.on('error', (err) => {
-      console.log('Python spawn error:', err.message);
-      if (err.code === 'ENOENT') {
-        // Try fallback to 'python' command
-        console.log('Trying fallback to python command...');
-        const fallbackProcess = spawn('python', ['-u', scriptPath, filePath, outputDir]);
-        
-        fallbackProcess.on('error', (fallbackErr) => {
-          console.log('Fallback python spawn error:', fallbackErr.message);
-          reject(new Error(`Could not start Python process. Make sure Python is installed and in PATH. Error: ${fallbackErr.message}`));
-        });
-        
-        // Replace the original process reference
-        pythonProcess = fallbackProcess;
-      } else {
-        reject(new Error(`Python process error: ${err.message}`));
-      }
-    });
-    
-    // Set a timeout for very long processing (15 minutes max)
-    const timeout = setTimeout(() => {
-      if (isProcessing) {
-        pythonProcess.kill('SIGTERM');
-        reject(new Error('Stem processing timed out after 15 minutes'));
+function attachStemWorker(pythonProcess) {
+  const worker = { process: pythonProcess, current: null, batchSize: 1, buffer: '' };
+
+  pythonProcess.stdin.on('error', (err) => {
+    console.log('Stem worker stdin error:', err.message);
+  });
+
+  pythonProcess.stdout.on('data', (data) => {
+    worker.buffer += data.toString();
+    const lines = worker.buffer.split('\n');
+    worker.buffer = lines.pop();
+
+    for (const rawLine of lines) {
+      const line = rawLine.trim();
+      if (!line) continue;
+
+      const batch = worker.current;
+
+      // The ready announcement, or the result line for one of the jobs in the current batch
+      if (line.startsWith('{') && line.endsWith('}')) {
+        try {
+          const result = JSON.parse(line);
+          if (result.worker_ready) {
+            worker.batchSize = Math.max(1, result.batch_size || 1);
+            continue;
+          }
+          const job = batch && batch.find(pending => pending.id === result.job_id);
+          if (job) {
+            clearTimeout(job.timeout);
+            batch.splice(batch.indexOf(job), 1);
+            job.resolve(result);
+            if (batch.length === 0) {
+              worker.current = null;
+              dispatchStemJob();
+            }
+            continue;
+          }
+        } catch (e) {
+          // Not a result line, forward it as progress
+        }
       }
-    }, 15 * 60 * 1000); // 15 minutes
 
-    // Send immediate start message
-    event.sender.send('stem-progress', 'PROGRESS: Python process starting...\n');
-    
-    // Debug: Check if python process actually started
-    setTimeout(() => {
-      if (isProcessing) {
-        console.log('Python process PID:', pythonProcess.pid);
-        console.log('Python process killed:', pythonProcess.killed);
-        event.sender.send('stem-progress', `DEBUG: Python process status - PID: ${pythonProcess.pid}, killed: ${pythonProcess.killed}\n`);
+      if (batch) {
+        new Set(batch.map(job => job.sender)).forEach(sender => sender.send('stem-progress', line));
       }
-    }, 2000);
-    
-    // Send keepalive messages during processing
-    const keepAliveInterval = setInterval(() => {
-      if (isProcessing) {
-        const elapsed = Math.floor((Date.now() - startTime) / 1000);
-        event.sender.send('stem-progress', `PROGRESS: Still waiting for Python response... ${elapsed}s elapsed\n`);
-        console.log(`Keepalive: ${elapsed}s elapsed, process status:`, {
-          pid: pythonProcess.pid,
-          killed: pythonProcess.killed,
-          connected: pythonProcess.connected
+
+      // Also emit as processing-update event for the new event listener
+      if (mainWindow) {
+        mainWindow.webContents.send('processing-update', {
+          type: 'stem-processing',
+          data: line
         });
       }
-    }, 10000); // Every 10 seconds for debugging
+    }
+  });
 
-    pythonProcess.stdout.on('data', (data) => {
-      hasReceivedData = true;
-      const dataStr = data.toString();
-      console.log('Python stdout received:', dataStr);
-      output += dataStr;
-      
-      // Send progress updates to renderer
-      const lines = dataStr.split('\n');
-      for (const line of lines) {
-        if (line.trim()) {
-          event.sender.send('stem-progress', line.trim());
-          
-          // Also emit as processing-update event for the new event listener
-          if (mainWindow) {
-            mainWindow.webContents.send('processing-update', {
-              type: 'stem-processing',
-              data: line.trim()
-            });
-          }
+  pythonProcess.stderr.on('data', (data) => {
+    const dataStr = data.toString();
+    console.log('Stem worker stderr:', dataStr);
+    if (worker.current) {
+      new Set(worker.current.map(job => job.sender)).forEach(sender => sender.send('stem-progress', `INFO: ${dataStr}`));
+    }
+  });
+
+  pythonProcess.on('close', (code) => {
+    console.log('Stem worker exited with code', code);
+    if (stemWorker === worker) {
+      stemWorker = null;
+    }
+    if (worker.current) {
+      const error = new Error(`Stem worker exited unexpectedly (code ${code})`);
+      worker.current.forEach(job => {
+        clearTimeout(job.timeout);
+        job.reject(error);
+      });
+      worker.current = null;
+    }
+    // Remaining jobs get a fresh worker
+    dispatchStemJob();
+  });
+
+  return worker;
+}
+
+function spawnStemWorker() {
+  const scriptPath = getStemScriptPath();
+  console.log('Starting stem worker:', scriptPath);
+
+  // Try 'py' first (Windows Python Launcher), then 'python'
+  // Use -u flag to force unbuffered stdout/stderr
+  const pythonProcess = spawn('py', ['-3', '-u', scriptPath, '--worker'], {
+    stdio: ['pipe', 'pipe', 'pipe'],
+    env: process.env
+  });
+  const worker = attachStemWorker(pythonProcess);
+
+  pythonProcess.on('error', (err) => {
+    console.log('Python spawn error:', err.message);
+    if (stemWorker !== worker) return;
+
+    if (err.code === 'ENOENT') {
+      console.log('Trying fallback to python command...');
+      const fallbackProcess = spawn('python', ['-u', scriptPath, '--worker'], {
+        stdio: ['pipe', 'pipe', 'pipe'],
+        env: process.env
+      });
+      const fallbackWorker = attachStemWorker(fallbackProcess);
+      fallbackWorker.current = worker.current;
+      worker.current = null;
+      stemWorker = fallbackWorker;
+
+      fallbackProcess.on('error', (fallbackErr) => {
+        console.log('Fallback python spawn error:', fallbackErr.message);
+        if (stemWorker === fallbackWorker) {
+          stemWorker = null;
         }
-      }
-    });
+        const error = new Error(`Could not start Python process. Make sure Python is installed and in PATH. Error: ${fallbackErr.message}`);
+        const pending = [...(fallbackWorker.current || []), ...stemJobQueue.splice(0)];
+        fallbackWorker.current = null;
+        pending.forEach(job => {
+          clearTimeout(job.timeout);
+          job.reject(error);
+        });
+      });
 
-    pythonProcess.stderr.on('data', (data) => {
-      hasReceivedData = true;
-      const dataStr = data.toString();
-      console.log('Python stderr received:', dataStr);
-      error += dataStr;
-      event.sender.send('stem-progress', `INFO: ${dataStr}`);
-    });
-    
-    // Check if we're receiving any data at all
-    setTimeout(() => {
-      if (!hasReceivedData && isProcessing) {
-        console.log('WARNING: No data received from Python process after 5 seconds');
-        event.sender.send('stem-progress', 'WARNING: Python process not sending output - checking if process is actually running...\n');
+      if (fallbackWorker.current) {
+        fallbackProcess.stdin.write(stemBatchMessage(fallbackWorker.current));
+      }
+    } else {
+      stemWorker = null;
+      if (worker.current) {
+        const error = new Error(`Python process error: ${err.message}`);
+        worker.current.forEach(job => {
+          clearTimeout(job.timeout);
+          job.reject(error);
+        });
+        worker.current = null;
       }
-    }, 5000);
+    }
+  });
 
-    pythonProcess.on('close', (code) => {
-      isProcessing = false;
-      clearTimeout(timeout);
-      clearInterval(keepAliveInterval);
-      
-      if (code === 0) {
-        try {
-          // Look for JSON result in the output
-          const lines = output.split('\n');
-          let jsonResult = null;
-          
-          // Find the last JSON line (the result)
-          for (let i = lines.length - 1; i >= 0; i--) {
-            const line = lines[i].trim();
-            if (line.startsWith('{') && line.endsWith('}')) {
-              try {
-                jsonResult = JSON.parse(line);
-                break;
-              } catch (e) {
-                continue;
-              }
-            }
-          }
-          
-          if (jsonResult) {
-            resolve(jsonResult);
-          } else {
-            // Fallback: assume success if code 0
-            resolve({ success: true, message: 'Processing completed', output: output });
-          }
-        } catch (parseError) {
-          console.log('Failed to parse Python output:', parseError);
-          resolve({ success: true, message: 'Processing completed', output: output });
-        }
-      } else {
-        reject(new Error(error || 'Processing failed'));
+  console.log('Stem worker spawned with PID:', pythonProcess.pid);
+  return worker;
+}
+
+function stemBatchMessage(batch) {
+  return JSON.stringify({ jobs: batch.map(job => job.payload) }) + '\n';
+}
+
+function dispatchStemJob() {
+  if (stemJobQueue.length === 0) return;
+  if (stemWorker && stemWorker.current) return;
+
+  if (!stemWorker) {
+    stemWorker = spawnStemWorker();
+  }
+
+  const batch = stemJobQueue.splice(0, stemWorker.batchSize);
+  stemWorker.current = batch;
+  batch.forEach(job => {
+    job.sender.send('stem-progress', 'PROGRESS: Python process starting...\n');
+
+    // Set a timeout for very long processing (15 minutes max per track)
+    job.timeout = setTimeout(() => {
+      // Looked up at expiry: the batch moves to the fallback worker if 'py' is missing
+      const worker = stemWorker;
+      if (!worker || !worker.current || !worker.current.includes(job)) return;
+
+      // The worker is stuck on this job; the rest of its batch is retried on a fresh worker
+      const rest = worker.current.filter(pending => pending !== job);
+      rest.forEach(pending => clearTimeout(pending.timeout));
+      worker.current = null;
+      stemJobQueue.unshift(...rest);
+      job.reject(new Error('Stem processing timed out after 15 minutes'));
+      // Detach first so jobs queued before 'close' go to a fresh worker, not this one's stdin
+      if (stemWorker === worker) {
+        stemWorker = null;
       }
-    });
+      worker.process.kill('SIGTERM');
+    }, STEM_JOB_TIMEOUT_MS);
+  });
+
+  stemWorker.process.stdin.write(stemBatchMessage(batch));
+}
+
+ipcMain.handle('process-stems', async (event, filePath, outputDir) => {
+  return new Promise((resolve, reject) => {
+    console.log('Queueing stem processing job');
+    console.log('File path:', filePath);
+    console.log('Output dir:', outputDir);
 
-    pythonProcess.on('error', (err) => {
-      isProcessing = false;
-      clearTimeout(timeout);
-      clearInterval(keepAliveInterval);
-      reject(err);
+    const id = `stems_${++stemJobCounter}`;
+    stemJobQueue.push({
+      id,
+      payload: { id, input_file: filePath, output_dir: outputDir },
+      sender: event.sender,
+      resolve,
+      reject
     });
+    dispatchStemJob();
   });
 });
 
+app.on('will-quit', () => {
+  if (stemWorker) {
+    stemWorker.process.stdin.end();
+  }
+});
+
 ipcMain.handle('download-audio', async (event, url, outputDir, downloadId) => {
   return new Promise((resolve, reject) => {
     const downloaderPath = isDev 